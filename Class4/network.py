@@ -17,10 +17,16 @@ modifiable.  It is not optimized, and omits many desirable features.
 import random
 
 # Third-party libraries
+from numba import njit
 import numpy as np
 
 
-# Helper functions not part of Network() class, but are used within class:
+# Helper functions not part of Network() class, but are used within class.
+# These elementwise kernels are the hottest code in training -- they run
+# once per layer per sample -- so they're JIT-compiled with Numba;
+# cache=True saves the compiled code to disk, so the one-time compile
+# cost is only paid on the first run per machine:
+@njit(cache=True, fastmath=True)
 def sigmoid(z):
     """The sigmoid function: prob of each neuron is between 0 and 1,
        vs softmax(), where prob of output is b/w 0 and 1.
@@ -28,6 +34,7 @@ def sigmoid(z):
     return 1.0/(1.0 + np.exp(-z))
 
 
+@njit(cache=True, fastmath=True)
 def sigmoid_prime(z):
     """Derivative of the sigmoid function."""
     return sigmoid(z) * (1 - sigmoid(z))
@@ -63,43 +70,52 @@ class Network():
             a = sigmoid(np.dot(wgt, a) + bias)
         return a
 
-    def SGD(self, training_data, learning_rate):
-        """Train the neural network using gradient descent. ``training_data``
-           is a list of tuples ``(x, y)`` representing the training inputs and
-           the desired outputs.
+    def SGD(self, x_all, y_all, learning_rate, mini_batch_size=32):
+        """Train the neural network using mini-batch stochastic gradient
+           descent. ``x_all`` is a (784, N) array holding one training
+           image per column; ``y_all`` is the matching (10, N) array of
+           desired outputs.
+           ---
+           Processing a mini-batch of columns as one matrix-matrix
+           multiply per layer does the work of ``mini_batch_size``
+           sample-by-sample passes in a single BLAS call.
         """
+        num_samples = x_all.shape[1]
         accuracy_new = 0
         while accuracy_new < 0.8:
             accuracy_old = accuracy_new
-            nabla_b = [np.zeros(bias.shape) for bias in self.biases]
-            nabla_w = [np.zeros(wgt.shape) for wgt in self.weights]
-            # --- Iterate over each labeled image in the data set:
-            for x, y in training_data:
-            	# --- Find small updates to weights and biases that may result
-            	#     in better fit:
-                delta_nabla_b, delta_nabla_w = self.backprop(x, y)
-                nabla_b = [nb + dnb for nb, dnb in zip(nabla_b, delta_nabla_b)]
-                nabla_w = [nw + dnw for nw, dnw in zip(nabla_w, delta_nabla_w)]
-            # --- Update weights and biases:
-            self.weights = [w - (learning_rate/len(training_data)) * nw
-                            for w, nw in zip(self.weights, nabla_w)]
-            self.biases = [b - (learning_rate/len(training_data)) * nb
-                           for b, nb in zip(self.biases, nabla_b)]
+            # --- Iterate over mini-batches of labeled images:
+            for start in range(0, num_samples, mini_batch_size):
+                x_batch = x_all[:, start:start + mini_batch_size]
+                y_batch = y_all[:, start:start + mini_batch_size]
+            	# --- Find small updates to weights and biases that may
+            	#     result in better fit, averaged across the mini-batch:
+                nabla_b, nabla_w = self.backprop(x_batch, y_batch)
+                # --- Update weights and biases:
+                self.weights = [w - learning_rate * nw
+                                for w, nw in zip(self.weights, nabla_w)]
+                self.biases = [b - learning_rate * nb
+                               for b, nb in zip(self.biases, nabla_b)]
             # --- Evaluate model fit:
-            true_positives = self.evaluate(training_data)
-            accuracy_new = float(true_positives)/len(training_data)
+            true_positives = self.evaluate(x_all, y_all)
+            accuracy_new = float(true_positives)/num_samples
             print(accuracy_new)
             if abs(accuracy_new - accuracy_old) < 0.00001:
             	# --- Stopping criteria, if model accuracy does not change:
                 break
-        return self.evaluate(training_data, accuracy=False)
+        return self.evaluate(x_all, y_all, accuracy=False)
 
     def backprop(self, x, y):
         """Return a tuple ``(nabla_b, nabla_w)`` representing the
-           gradient for the cost function C_x.  ``nabla_b`` and
-           ``nabla_w`` are layer-by-layer lists of numpy arrays, similar
-           to ``self.biases`` and ``self.weights``.
+           gradient for the cost function, averaged over a mini-batch.
+           ``x`` is (784, batch_size) and ``y`` is (10, batch_size), one
+           sample per column; the elementwise sigmoid ops broadcast
+           across the batch axis, so the same backprop equations apply
+           column-by-column. ``nabla_b`` and ``nabla_w`` are
+           layer-by-layer lists of numpy arrays, similar to
+           ``self.biases`` and ``self.weights``.
         """
+        batch_size = x.shape[1]
         nabla_b = [np.zeros(bias.shape) for bias in self.biases]
         nabla_w = [np.zeros(wgt.shape) for wgt in self.weights]
         # --- Feedforward (through each layer, starting from the first):
@@ -117,10 +133,11 @@ class Network():
         #
         # Equation BP1 in book:
         delta = self.cost_derivative(activations[-1], y) * sigmoid_prime(zs[-1])
-        # Equation BP3 in book:
-        nabla_b[-1] = delta
-        # Equation BP4 in book:
-        nabla_w[-1] = np.dot(delta, activations[-2].transpose())
+        # Equation BP3 in book, averaged across the mini-batch:
+        nabla_b[-1] = delta.mean(axis=1, keepdims=True)
+        # Equation BP4 in book; the matrix product sums the per-sample
+        # outer products, so dividing by batch_size gives the average:
+        nabla_w[-1] = np.dot(delta, activations[-2].transpose()) / batch_size
         # Here, l = 1 means the last layer of neurons, l = 2 is second-to-last
         # layer, etc., to take advantage of Python's use of negative indices:
         for l in range(2, self.num_layers):
@@ -129,29 +146,31 @@ class Network():
             # Equation BP2 in book:
             delta = np.dot(self.weights[-l+1].transpose(), delta) * sp
             # Equation BP3 in book:
-            nabla_b[-l] = delta
+            nabla_b[-l] = delta.mean(axis=1, keepdims=True)
             # Equation BP4 in book:
-            nabla_w[-l] = np.dot(delta, activations[-l-1].transpose())
+            nabla_w[-l] = np.dot(delta, activations[-l-1].transpose()) / batch_size
         # Find small updates to weights and biases that may result in better fit:
         return (nabla_b, nabla_w)
 
-    def evaluate(self, test_data, accuracy=True):
+    def evaluate(self, x_all, y_all, accuracy=True):
         """Return overall network accuracy or probabilities of each neuron given
-           by the network.
+           by the network, for the (784, N) features and (10, N) outcomes.
 		   ---
 		   TODO: Candidate for refactoring, as uses if/else statement w/ output.
         """
-        # For each labeled image in the data set, see which class the network
-        # predicts, and which class is the labeled class:
-        test_results = [(np.argmax(self.feedforward(x)), np.argmax(y)) for
-                        (x, y) in test_data]
+        # Feed the whole data set through the network in one matrix
+        # multiply per layer, giving a (10, N) array of outputs:
+        outputs = self.feedforward(x_all)
         if accuracy:
         	# Compare predicted and observed labels:
-            return sum(int(y_pred == y) for (y_pred, y) in test_results)
+            return int(np.sum(outputs.argmax(axis=0) == y_all.argmax(axis=0)))
         else:
         	# Return probabilities associated with each neuron, rather than
-        	# returning labels:
-            return [self.feedforward(x) for (x, y) in test_data]
+        	# returning labels, as one preallocated (N, 10) float32 array
+        	# with a row per image -- no per-image Python object churn:
+            res = np.empty((x_all.shape[1], self.sizes[-1]), dtype=np.float32)
+            res[:] = outputs.transpose()
+            return res
 
     def cost_derivative(self, output_activations, y):
         """Return the vector of partial derivatives of quadratic cost function.